@@ -0,0 +1,238 @@
+import argparse
+import calendar
+import datetime
+import gzip
+import json
+import os
+import random
+import shutil
+
+APP_ROOT = '/nail/srv/app'
+# written into every generated directory, directories without it are never overwritten
+MARKER_FILE = '.generated_by_benchmark'
+# frames outside of APP_ROOT, they are stripped by stack_profiler_viewer.handle_file unless `show_others` is set
+SERVER_FRAMES = [
+    ('/usr/lib/python2.7/site-packages/gevent/greenlet.py', 534, 'run'),
+    ('/usr/lib/python2.7/site-packages/gevent/baseserver.py', 26, '_handle_and_close_when_done'),
+    ('/usr/lib/python2.7/site-packages/gevent/pywsgi.py', 935, 'handle'),
+    ('/usr/lib/python2.7/site-packages/gevent/pywsgi.py', 884, 'handle_one_request'),
+    ('/usr/lib/python2.7/site-packages/flask/app.py', 1982, 'wsgi_app'),
+]
+LIBRARY_FRAMES = [
+    ('/usr/lib/python2.7/json/encoder.py', 186, 'encode'),
+    ('/usr/lib/python2.7/socket.py', 447, 'readline'),
+    ('/usr/lib/python2.7/site-packages/redis/client.py', 664, 'execute_command'),
+    ('/usr/lib/python2.7/site-packages/sqlalchemy/engine/base.py', 1139, '_execute_context'),
+    ('/usr/lib/python2.7/ssl.py', 653, 'read'),
+]
+
+
+class LogConfig(object):
+    def __init__(self, log_dir='/tmp/python_profiler_benchmark/logdir', repo='default', date=None, hosts=4,
+                 compression='mixed', functions=200, stacks=500, min_depth=10, max_depth=40, stack_lines=20000,
+                 perftree_records=200, tree_depth=6, tree_fanout=4, seed=0):
+        self.log_dir = log_dir
+        self.repo = repo
+        self.date = date if date else datetime.datetime.utcnow().date()
+        self.hosts = hosts
+        self.compression = compression
+        self.functions = functions
+        self.stacks = stacks
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.stack_lines = stack_lines
+        self.perftree_records = perftree_records
+        self.tree_depth = tree_depth
+        self.tree_fanout = tree_fanout
+        self.seed = seed
+
+    def to_dict(self):
+        d = dict(self.__dict__)
+        d['date'] = str(self.date)
+        return d
+
+    def host_names(self):
+        return ['host{:03d}'.format(i) for i in range(self.hosts)]
+
+    def is_gzip(self, host_index):
+        if self.compression == 'mixed':
+            return host_index % 2 == 1
+        return self.compression == 'gzip'
+
+    def day_dir(self):
+        return '{}/{}/{}{:02d}{:02d}'.format(self.log_dir, self.date.year, self.date.year, self.date.month,
+                                             self.date.day)
+
+    def stack_dir(self):
+        return '{}/{}.stack'.format(self.day_dir(), self.repo)
+
+    def perftree_dir(self):
+        return '{}/{}.perftree'.format(self.day_dir(), self.repo)
+
+    def start_ts(self):
+        return calendar.timegm(self.date.timetuple())
+
+    def end_ts(self):
+        return self.start_ts() + 86400 - 1
+
+
+def skewed_choice(rand, items):
+    # a few items are picked much more often than the others, like hot code paths in a real server
+    return items[int(len(items) * rand.random() ** 3)]
+
+
+def make_functions(rand, count):
+    functions = []
+    for i in range(count):
+        module = 'module{}'.format(i % max(1, count // 10))
+        name = '{}.{}.Handler{}.method{}'.format('app', module, i % 7, i)
+        path = '{}/{}.py'.format(APP_ROOT, module)
+        functions.append((name, path, rand.randint(1, 2000)))
+    return functions
+
+
+def make_stacks(rand, config, functions):
+    """
+    Build `config.stacks` distinct stacks, innermost frame first as written by stack_profiler.Collector
+    """
+    stacks = []
+    for _ in range(config.stacks):
+        depth = rand.randint(config.min_depth, config.max_depth)
+        outer = SERVER_FRAMES[:max(1, min(len(SERVER_FRAMES), depth // 4))]
+        inner = [rand.choice(LIBRARY_FRAMES)] if rand.random() < 0.5 else []
+        app = []
+        for _ in range(max(1, depth - len(outer) - len(inner))):
+            name, path, line = skewed_choice(rand, functions)
+            app.append((path, line, name.rsplit('.', 1)[-1]))
+        stacks.append(inner + app + list(reversed(outer)))
+    return stacks
+
+
+def log_prefix(ts, logger_name):
+    # the viewer reads the first 15 characters as time, skips one token and splits the rest at the first ': '
+    return '{} INFO {}: '.format(datetime.datetime.utcfromtimestamp(ts).strftime('%y%m%d %H:%M:%S'), logger_name)
+
+
+def open_log(path, use_gzip):
+    if use_gzip:
+        return gzip.open(path + '.gz', 'wb')
+    return open(path, 'w')
+
+
+def write_stack_log(f, rand, config, stacks):
+    start_ts = config.start_ts()
+    for i in range(config.stack_lines):
+        ts = start_ts + i * 86400 // max(1, config.stack_lines)
+        stack = skewed_choice(rand, stacks)
+        count = int(1 + rand.expovariate(0.2))
+        f.write('{}{} {}&&&{}\n'.format(log_prefix(ts, 'stack_profiler_data'), ts, json.dumps(stack), count))
+
+
+def get_node_info(func, location, time_elapsed, percentage):
+    # same format as generic_profiler.log_performance_tree
+    return '[{:5.1f}%,{:5.3f}s] {}<{}>'.format(percentage, time_elapsed, func, location)
+
+
+def make_tree(rand, config, functions, func, location, time_elapsed, all_time, depth):
+    children = []
+    if depth < config.tree_depth:
+        fanout = rand.randint(0, config.tree_fanout)
+        remaining = time_elapsed
+        pre_location = 'start'
+        for _ in range(fanout):
+            child_func, path, line = skewed_choice(rand, functions)
+            child_location = '{}:{}'.format(path, rand.randint(1, 2000))
+            interval = remaining * rand.random() * 0.2
+            child_time = (remaining - interval) * rand.random()
+            remaining -= interval + child_time
+            children.append(get_node_info('<interval>', 'from {} to {}'.format(pre_location, child_location),
+                                          interval, interval * 100 / all_time))
+            children.append(make_tree(rand, config, functions, child_func, child_location, child_time, all_time,
+                                      depth + 1))
+            pre_location = child_location
+        if fanout:
+            children.append(get_node_info('<interval>', 'from {} to end'.format(pre_location), remaining,
+                                          remaining * 100 / all_time))
+    return {get_node_info(func, location, time_elapsed, time_elapsed * 100 / all_time): children}
+
+
+def write_perftree_log(f, rand, config, functions):
+    start_ts = config.start_ts()
+    for i in range(config.perftree_records):
+        ts = start_ts + i * 86400 // max(1, config.perftree_records)
+        func, path, line = skewed_choice(rand, functions)
+        # only requests slower than the threshold of log_performance_tree are logged
+        all_time = 3 + rand.expovariate(0.5)
+        output = {'parameter': {'args': [rand.randint(0, 10 ** 6)], 'kwargs': {'query': 'q{}'.format(i)}}}
+        output.update(make_tree(rand, config, functions, func, '{}:{}'.format(path, line), all_time, all_time, 0))
+        f.write('{}{}\n'.format(log_prefix(ts, 'generic_profiler_data'), json.dumps(output)))
+
+
+def generate(config):
+    """
+    Write `.stack` and `.perftree` logs of every host under `config.log_dir`, the output only depends on `config`.
+    Logs left in the same directories by a previous run are removed, so they never leak into the benchmarks.
+    Directories that were not written by this generator, e.g. real logs, are refused instead of removed.
+    """
+    rand = random.Random(config.seed)
+    functions = make_functions(rand, config.functions)
+    stacks = make_stacks(rand, config, functions)
+    for directory in (config.stack_dir(), config.perftree_dir()):
+        if os.path.exists(directory) and not os.path.isfile(os.path.join(directory, MARKER_FILE)):
+            raise Exception('refuse to overwrite {}, it is not generated by generate_logs'.format(directory))
+    for directory in (config.stack_dir(), config.perftree_dir()):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        open(os.path.join(directory, MARKER_FILE), 'w').close()
+    for i, host in enumerate(config.host_names()):
+        use_gzip = config.is_gzip(i)
+        with open_log('{}/{}.log'.format(config.stack_dir(), host), use_gzip) as f:
+            write_stack_log(f, rand, config, stacks)
+        with open_log('{}/{}.log'.format(config.perftree_dir(), host), use_gzip) as f:
+            write_perftree_log(f, rand, config, functions)
+
+
+def add_arguments(parser):
+    defaults = LogConfig()
+    parser.add_argument("--log-dir", help="root of the generated logs, directories written by a previous run are "
+                                          "overwritten, others are never touched", default=defaults.log_dir)
+    parser.add_argument("--repo", help="repo name of the generated logs", default=defaults.repo)
+    parser.add_argument("--date", help="day of the generated logs, YYYY-MM-DD", default=str(defaults.date),
+                        type=lambda val: datetime.datetime.strptime(val, '%Y-%m-%d').date())
+    parser.add_argument("--hosts", help="number of hosts", default=defaults.hosts, type=int)
+    parser.add_argument("--compression", help="gzip the logs, `mixed` gzips every other host",
+                        choices=["plain", "gzip", "mixed"], default=defaults.compression)
+    parser.add_argument("--functions", help="number of distinct functions", default=defaults.functions, type=int)
+    parser.add_argument("--stacks", help="number of distinct stacks", default=defaults.stacks, type=int)
+    parser.add_argument("--min-depth", help="min stack depth", default=defaults.min_depth, type=int)
+    parser.add_argument("--max-depth", help="max stack depth", default=defaults.max_depth, type=int)
+    parser.add_argument("--stack-lines", help="lines of stack log per host", default=defaults.stack_lines, type=int)
+    parser.add_argument("--perftree-records", help="records of perftree log per host",
+                        default=defaults.perftree_records, type=int)
+    parser.add_argument("--tree-depth", help="max depth of perftree records", default=defaults.tree_depth, type=int)
+    parser.add_argument("--tree-fanout", help="max children of a perftree node", default=defaults.tree_fanout,
+                        type=int)
+    parser.add_argument("--seed", help="random seed", default=defaults.seed, type=int)
+
+
+def config_from_args(args):
+    return LogConfig(log_dir=args.log_dir, repo=args.repo, date=args.date, hosts=args.hosts,
+                     compression=args.compression, functions=args.functions, stacks=args.stacks,
+                     min_depth=args.min_depth, max_depth=args.max_depth, stack_lines=args.stack_lines,
+                     perftree_records=args.perftree_records, tree_depth=args.tree_depth,
+                     tree_fanout=args.tree_fanout, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate synthetic profiler logs', prog='python generate_logs',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args)
+    generate(config)
+    print('logs written to {}'.format(config.day_dir()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'logger'))
+sys.path.insert(0, os.path.join(ROOT, 'viewer'))
+
+import generate_logs
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def summarize(samples, **extra):
+    samples = sorted(samples)
+    output = {'unit': 's', 'samples': len(samples), 'min': samples[0], 'max': samples[-1],
+              'mean': sum(samples) / len(samples), 'median': percentile(samples, 0.5),
+              'p90': percentile(samples, 0.9), 'p99': percentile(samples, 0.99)}
+    output.update(extra)
+    return output
+
+
+def measure(func, number, repeat, setup=None, teardown=None):
+    """
+    Call `func` `number` times in each of `repeat` rounds, every sample is the average time of one call in a round
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = timeit.default_timer()
+        for _ in itertools.repeat(None, number):
+            func()
+        samples.append((timeit.default_timer() - start) / number)
+        if teardown:
+            teardown()
+    return samples
+
+
+def call_at_depth(depth, func):
+    if depth <= 1:
+        return func()
+    return call_at_depth(depth - 1, func)
+
+
+@benchmark('collector_handler')
+def bench_collector_handler(config, options):
+    import stack_profiler
+
+    # the handler walks the stacks of every thread, so park some threads at the same depth as the sampled one
+    release = threading.Event()
+    threads = [threading.Thread(target=call_at_depth, args=(config.max_depth, release.wait))
+               for _ in range(options.collector_threads)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    # a huge flush period keeps file logging out of the measurement
+    collector = stack_profiler.Collector(0.01, 10 ** 9, 'real')
+    try:
+        samples = call_at_depth(config.max_depth, lambda: measure(
+            lambda: collector.handler(signal.SIGALRM, sys._getframe()), options.number, options.repeat))
+    finally:
+        release.set()
+    return {'collector_handler': summarize(samples, threads=len(threads) + 1, depth=config.max_depth)}
+
+
+@benchmark('generic_profiler_wrapper')
+def bench_generic_profiler_wrapper(config, options):
+    import generic_profiler
+
+    def func():
+        pass
+
+    profiler = generic_profiler.GenericProfiler(None)
+    wrapped = profiler.wrapper(func)
+
+    def init_root():
+        generic_profiler.init_performance_tree('benchmark', 'benchmark', time.time())
+
+    def root_call():
+        wrapped()
+        generic_profiler.clear()
+
+    def baseline_root_call():
+        func()
+        generic_profiler.clear()
+
+    # every case is compared with a baseline doing the same work except the wrapper
+    baseline_root = measure(baseline_root_call, options.number, options.repeat)
+    root = measure(root_call, options.number, options.repeat)
+    baseline_nested = measure(func, options.number, options.repeat)
+    nested = measure(wrapped, options.number, options.repeat, setup=init_root, teardown=generic_profiler.clear)
+    return {
+        'generic_profiler_wrapper.baseline.root': summarize(baseline_root),
+        'generic_profiler_wrapper.root': summarize(
+            root, overhead=summarize(root)['median'] - summarize(baseline_root)['median']),
+        'generic_profiler_wrapper.baseline.nested': summarize(baseline_nested),
+        'generic_profiler_wrapper.nested': summarize(
+            nested, overhead=summarize(nested)['median'] - summarize(baseline_nested)['median']),
+    }
+
+
+def count_lines(path):
+    with (gzip.open(path) if path.endswith('.gz') else open(path)) as f:
+        return sum(1 for _ in f)
+
+
+def throughput(samples, path_list):
+    lines = sum(count_lines(path) for path in path_list)
+    size = sum(os.path.getsize(path) for path in path_list)
+    median = summarize(samples)['median']
+    return summarize(samples, lines=lines, bytes=size, lines_per_sec=lines / median, bytes_per_sec=size / median)
+
+
+def list_logs(directory):
+    return sorted(os.path.join(directory, file_name) for file_name in os.listdir(directory)
+                  if file_name.endswith('.log') or file_name.endswith('.log.gz'))
+
+
+def logs_by_kind(directory):
+    """
+    The first plain and the first gzip log in `directory`, a kind is missing if no log is compressed that way
+    """
+    logs = {}
+    for path in list_logs(directory):
+        logs.setdefault('gzip' if path.endswith('.gz') else 'plain', path)
+    return logs
+
+
+@benchmark('stack_profiler_viewer')
+def bench_stack_profiler_viewer(config, options):
+    import stack_profiler_viewer
+
+    results = {}
+    for kind, path in sorted(logs_by_kind(config.stack_dir()).items()):
+        samples = measure(lambda: stack_profiler_viewer.get_stacks(path, config.start_ts(), config.end_ts(), False),
+                          1, options.repeat)
+        results['stack_profiler_viewer.handle_file.' + kind] = throughput(samples, [path])
+    samples = measure(lambda: stack_profiler_viewer.fold_data([config.stack_dir()], None, config.start_ts(),
+                                                              config.end_ts(),
+                                                              stack_profiler_viewer.FlamegraphFormatter(), False),
+                      1, options.repeat)
+    results['stack_profiler_viewer.fold_data'] = throughput(samples, list_logs(config.stack_dir()))
+    return results
+
+
+@benchmark('perftree_aggregator')
+def bench_perftree_aggregator(config, options):
+    import perftree_aggregator
+
+    results = {}
+    for kind, path in sorted(logs_by_kind(config.perftree_dir()).items()):
+        samples = measure(lambda: perftree_aggregator.aggregate_file(path), 1, options.repeat)
+        results['perftree_aggregator.aggregate_file.' + kind] = throughput(samples, [path])
+    return results
+
+
+@benchmark('routes')
+def bench_routes(config, options):
+    import main as viewer
+    import perftree_aggregator
+    import stack_profiler_viewer
+
+    stack_profiler_viewer.LOG_DIR = config.log_dir
+    perftree_aggregator.CACHE_DIR = os.path.join(os.path.dirname(config.log_dir), 'aggregate_cache')
+    if not os.path.exists('/tmp/stack_profiler'):
+        os.makedirs('/tmp/stack_profiler')
+    # noon of the generated day, so the local date of the viewer matches in every timezone
+    noon = config.start_ts() + 43200
+    host = config.host_names()[0]
+    urls = {
+        '/stack_profiler': '/stack_profiler?repo={}&start={}&end={}'.format(config.repo, noon - 3600, noon),
+        '/generic_profiler/thumbnail': '/generic_profiler/thumbnail?repo={}&date={}'.format(config.repo, noon),
+        '/generic_profiler/detail': '/generic_profiler/detail?repo={}&date={}&host={}&line=0'.format(config.repo,
+                                                                                                      noon, host),
+        '/generic_profiler/aggregate': '/generic_profiler/aggregate?repo={}&date={}'.format(config.repo, noon),
+    }
+    client = viewer.app.test_client()
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200 or response.data == 'No data':
+            raise Exception('{} returns {} {}'.format(url, response.status_code, response.data[:100]))
+
+    def clear_cache():
+        if os.path.exists(perftree_aggregator.CACHE_DIR):
+            shutil.rmtree(perftree_aggregator.CACHE_DIR)
+
+    results = {}
+    for name, url in sorted(urls.items()):
+        if name == '/generic_profiler/aggregate':
+            # a cold request parses the logs and writes the cache, the warm ones only merge the cached sketches
+            samples = measure(lambda: get(url), 1, options.requests, setup=clear_cache)
+            results['route.{}.cold'.format(name)] = summarize(samples)
+            samples = measure(lambda: get(url), 1, options.requests)
+            results['route.{}.warm'.format(name)] = summarize(samples)
+        else:
+            results['route.' + name] = summarize(measure(lambda: get(url), 1, options.requests))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, options):
+    results = {}
+    errors = {}
+    for name in options.benchmarks:
+        logger.info('run benchmark: ' + name)
+        try:
+            results.update(BENCHMARKS[name](config, options))
+        except ImportError as e:
+            logger.error('skip benchmark {}: {}'.format(name, e))
+            errors[name] = str(e)
+    meta = {'time': int(time.time()), 'python': sys.version, 'platform': platform.platform(),
+            'git_revision': git_revision(), 'log_config': config.to_dict(), 'number': options.number,
+            'repeat': options.repeat, 'requests': options.requests, 'errors': errors}
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current):
+    lines = []
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        old = baseline['results'].get(name)
+        new = current['results'].get(name)
+        if not old or not new:
+            lines.append('{:60s} {}'.format(name, 'only in baseline' if old else 'new'))
+            continue
+        lines.append('{:60s} {:12.6g} -> {:12.6g} {:7.2f}x'.format(name, old['median'], new['median'],
+                                                                   new['median'] / old['median']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the profiler pipeline on synthetic logs',
+                                     prog='python run_benchmarks',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--benchmarks", help="benchmarks to run", nargs='+', choices=sorted(BENCHMARKS),
+                        default=sorted(BENCHMARKS))
+    parser.add_argument("--output", help="json output file name, results of runs can be compared by --compare",
+                        default='/tmp/python_profiler_benchmark/result-{}.json'.format(int(time.time())))
+    parser.add_argument("--compare", help="json output of a previous run to compare with", default=None)
+    parser.add_argument("--number", help="calls per round of micro benchmarks", default=10000, type=int)
+    parser.add_argument("--repeat", help="rounds of every benchmark", default=5, type=int)
+    parser.add_argument("--requests", help="requests sent to every route", default=20, type=int)
+    parser.add_argument("--collector-threads", help="idle threads sampled by the collector", default=4, type=int)
+    parser.add_argument("--skip-generate", action='store_true', help="reuse the logs generated by a previous run")
+    generate_logs.add_arguments(parser)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = generate_logs.config_from_args(options)
+    if not options.skip_generate:
+        logger.info('generate logs in ' + config.day_dir())
+        generate_logs.generate(config)
+    output = run(config, options)
+    output_dir = os.path.dirname(os.path.abspath(options.output))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(options.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    logger.info('results written to ' + options.output)
+    if options.compare:
+        with open(options.compare) as f:
+            print(compare(json.load(f), output))
+
+
+if __name__ == '__main__':
+    main()
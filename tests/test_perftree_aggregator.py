@@ -0,0 +1,186 @@
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'logger'))
+sys.path.insert(0, os.path.join(ROOT, 'viewer'))
+
+import generic_profiler
+import perftree_aggregator
+import stack_profiler_viewer
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def log_tree(calls):
+    """
+    Log a performance tree through generic_profiler.log_performance_tree, `calls` is a nested
+    (func, location, start_ts, end_ts, children) tuple, returns the logged json
+    """
+    def build(parent, call):
+        func, location, start_ts, end_ts, children = call
+        node = generic_profiler.PerformanceTree(parent, func, location, start_ts)
+        for child in children:
+            build(node, child)
+        node.finish(end_ts)
+        return node
+
+    handler = ListHandler()
+    level = generic_profiler.data_logger.level
+    generic_profiler.data_logger.addHandler(handler)
+    generic_profiler.data_logger.setLevel(logging.INFO)
+    try:
+        generic_profiler.init_performance_tree(calls[0], calls[1], calls[2])
+        ctx = generic_profiler.get_context()
+        ctx.performance_tree_root = build(None, calls)
+        generic_profiler.log_performance_tree(threshold=0)
+    finally:
+        generic_profiler.data_logger.removeHandler(handler)
+        generic_profiler.data_logger.setLevel(level)
+        generic_profiler.clear()
+    return json.loads(handler.messages[0])
+
+
+class QuantileSketchTest(unittest.TestCase):
+    def test_quantile_within_relative_accuracy(self):
+        rand = random.Random(0)
+        values = sorted(rand.lognormvariate(0, 2) for _ in range(10000))
+        sketch = perftree_aggregator.QuantileSketch(0.01)
+        for value in values:
+            sketch.add(value)
+        for q in (0.01, 0.1, 0.5, 0.9, 0.99, 0.999):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.01 * exact)
+        self.assertEqual(sketch.quantile(1), values[-1])
+
+    def test_merge_equals_single_sketch(self):
+        rand = random.Random(1)
+        values = [rand.expovariate(1) for _ in range(1000)]
+        whole = perftree_aggregator.QuantileSketch()
+        first = perftree_aggregator.QuantileSketch()
+        second = perftree_aggregator.QuantileSketch()
+        for i, value in enumerate(values):
+            whole.add(value)
+            (first if i % 2 else second).add(value)
+        first.merge(perftree_aggregator.QuantileSketch.from_dict(json.loads(json.dumps(second.to_dict()))))
+        for q in (0.5, 0.9, 0.99):
+            self.assertEqual(first.quantile(q), whole.quantile(q))
+        self.assertEqual(first.count, whole.count)
+
+    def test_zero_values(self):
+        sketch = perftree_aggregator.QuantileSketch()
+        for value in (0, 0, 0, 1):
+            sketch.add(value)
+        self.assertEqual(sketch.quantile(0.5), 0)
+
+
+class AggregationTest(unittest.TestCase):
+    def test_parse_logged_tree(self):
+        tree = log_tree(('app.handle', '<string>:1', 0, 4, [
+            ('app.query', 'app.py:10', 1, 2, []),
+            ('app.render', 'app.py:20', 2.5, 3.5, []),
+        ]))
+        aggregation = perftree_aggregator.Aggregation()
+        tree.pop('parameter', None)
+        aggregation.add_tree(tree)
+        self.assertEqual(sorted(aggregation.functions), ['app.handle', 'app.query', 'app.render'])
+        self.assertEqual(sorted(aggregation.call_sites),
+                         ['app.handle@<string>:1', 'app.query@app.py:10', 'app.render@app.py:20'])
+        self.assertAlmostEqual(aggregation.functions['app.handle'].total, 4)
+        self.assertAlmostEqual(aggregation.functions['app.query'].total, 1)
+
+    def test_recursive_call_counted_once_per_function(self):
+        tree = log_tree(('f', 'a.py:1', 0, 1, [
+            ('f', 'a.py:2', 0.05, 0.95, [
+                ('f', 'a.py:2', 0.1, 0.9, []),
+            ]),
+        ]))
+        tree.pop('parameter', None)
+        aggregation = perftree_aggregator.Aggregation()
+        aggregation.add_tree(tree)
+        self.assertEqual(aggregation.functions['f'].count, 1)
+        self.assertAlmostEqual(aggregation.functions['f'].total, 1)
+        self.assertEqual(aggregation.call_sites['f@a.py:2'].count, 2)
+
+    def test_handle_file_skips_invalid_lines(self):
+        tree = log_tree(('f', 'a.py:1', 0, 1, []))
+        lines = ['no separator\n', 'x: not json\n', 'x: [1, 2]\n', 'x: {}\n'.format(json.dumps(tree))]
+        aggregation = perftree_aggregator.Aggregation()
+        perftree_aggregator.handle_file(lines, aggregation)
+        self.assertEqual(aggregation.records, 1)
+        self.assertEqual(aggregation.functions['f'].count, 1)
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_dir = stack_profiler_viewer.LOG_DIR
+        self.cache_dir = perftree_aggregator.CACHE_DIR
+        self.aggregate_file = perftree_aggregator.aggregate_file
+        stack_profiler_viewer.LOG_DIR = os.path.join(self.tmp_dir, 'log')
+        perftree_aggregator.CACHE_DIR = os.path.join(self.tmp_dir, 'cache')
+        self.parsed = []
+
+        def aggregate_file(path):
+            self.parsed.append(path)
+            return self.aggregate_file(path)
+
+        perftree_aggregator.aggregate_file = aggregate_file
+        self.date = datetime.date(2017, 3, 1)
+        os.makedirs(perftree_aggregator.get_log_dir(self.date, 'repo'))
+
+    def tearDown(self):
+        stack_profiler_viewer.LOG_DIR = self.log_dir
+        perftree_aggregator.CACHE_DIR = self.cache_dir
+        perftree_aggregator.aggregate_file = self.aggregate_file
+        shutil.rmtree(self.tmp_dir)
+
+    def append_record(self, host):
+        tree = log_tree(('f', 'a.py:1', 0, 1, []))
+        with open('{}/{}.log'.format(perftree_aggregator.get_log_dir(self.date, 'repo'), host), 'a') as f:
+            f.write('170301 10:00:00 INFO generic_profiler_data: {}\n'.format(json.dumps(tree)))
+
+    def test_cache_reused_and_invalidated(self):
+        self.append_record('web1.example.com')
+        result = perftree_aggregator.aggregate(self.date, self.date, 'repo')
+        self.assertEqual(result['web1.example.com'].records, 1)
+        self.assertEqual(len(self.parsed), 1)
+
+        result = perftree_aggregator.aggregate(self.date, self.date, 'repo')
+        self.assertEqual(result['web1.example.com'].records, 1)
+        self.assertEqual(len(self.parsed), 1)
+
+        self.append_record('web1.example.com')
+        result = perftree_aggregator.aggregate(self.date, self.date, 'repo')
+        self.assertEqual(result['web1.example.com'].records, 2)
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_reject_path_in_names(self):
+        for host in ('../../victim/evil', 'a/b', '..'):
+            self.assertRaises(ValueError, perftree_aggregator.aggregate, self.date, self.date, 'repo', [host])
+        self.assertRaises(ValueError, perftree_aggregator.aggregate, self.date, self.date, '../repo')
+        self.assertFalse(os.path.exists(perftree_aggregator.CACHE_DIR))
+
+    def test_date_range(self):
+        self.assertRaises(ValueError, perftree_aggregator.aggregate, self.date,
+                          self.date + datetime.timedelta(days=perftree_aggregator.MAX_DAYS), 'repo')
+        self.assertRaises(ValueError, perftree_aggregator.aggregate, self.date,
+                          self.date - datetime.timedelta(days=1), 'repo')
+
+
+if __name__ == '__main__':
+    unittest.main()
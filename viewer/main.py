@@ -8,8 +8,9 @@ import subprocess
 import time
 import uuid
 
-from flask import Flask, request, send_file, send_from_directory, render_template, redirect, url_for
+from flask import Flask, request, send_file, send_from_directory, render_template, redirect, url_for, jsonify
 
+import perftree_aggregator
 import stack_profiler_viewer
 
 app = Flask(__name__)
@@ -36,8 +37,8 @@ def generic_profiler():
     repo = request.args.get('repo', 'default')
     host = request.args.get('host', 'default')
     line_num = int(request.args.get('line', 0))
-    path = '/logdir/{}/{}{:02d}{:02d}/{}.perftree/{}.log'.format(date.year, date.year, date.month, date.day, repo,
-                                                                      host)
+    path = '{}/{}/{}{:02d}{:02d}/{}.perftree/{}.log'.format(stack_profiler_viewer.LOG_DIR, date.year, date.year,
+                                                            date.month, date.day, repo, host)
     if os.path.isfile(path):
         with open(path) as f:
             for i, line in enumerate(f):
@@ -68,7 +69,8 @@ def generic_profiler_thumbnail():
     repo = request.args.get('repo', 'default')
     hosts = request.args.get('hosts', None)
     hosts = hosts.split('+') if hosts else []
-    log_dir = '/logdir/{}/{}{:02d}{:02d}/{}.perftree'.format(date.year, date.year, date.month, date.day, repo)
+    log_dir = '{}/{}/{}{:02d}{:02d}/{}.perftree'.format(stack_profiler_viewer.LOG_DIR, date.year, date.year,
+                                                        date.month, date.day, repo)
     log_paths = ['{}/{}.log'.format(log_dir, host) for host in hosts] if hosts else \
         ['{}/{}'.format(log_dir, file_name) for file_name in (os.listdir(log_dir) if os.path.isdir(log_dir) else [])]
     if not hosts:
@@ -111,6 +113,36 @@ def generic_profiler_thumbnail():
         return 'No data'
 
 
+@app.route("/generic_profiler/aggregate", methods=['GET'])
+def generic_profiler_aggregate():
+    # results always cover whole days, `date` aggregates a single day like /generic_profiler/detail
+    date = request.args.get('date', int(time.time()))
+    start_date = request.args.get('start_date', date)
+    end_date = request.args.get('end_date', date)
+    repo = request.args.get('repo', 'default')
+    hosts = request.args.get('hosts', None)
+    hosts = hosts.split('+') if hosts else None
+    func = request.args.get('func', None)
+    by_host = request.args.get('by_host', False)
+    quantiles = request.args.get('quantiles', None)
+    try:
+        quantiles = [float(q) for q in quantiles.split('+')] if quantiles else perftree_aggregator.DEFAULT_QUANTILES
+    except ValueError:
+        return 'Invalid quantiles: {}'.format(request.args.get('quantiles')), 400
+    if not all(0 <= q <= 1 for q in quantiles):
+        return 'Quantiles should be in [0, 1]: {}'.format(request.args.get('quantiles')), 400
+    try:
+        aggregations = perftree_aggregator.aggregate(perftree_aggregator.valid_day(start_date),
+                                                     perftree_aggregator.valid_day(end_date), repo, hosts)
+    except ValueError as e:
+        return str(e), 400
+    if not sum(aggregation.records for aggregation in aggregations.values()):
+        return 'No data'
+    if by_host:
+        return jsonify(dict((host, aggregation.summary(quantiles, func)) for host, aggregation in aggregations.items()))
+    return jsonify(perftree_aggregator.merge_hosts(aggregations).summary(quantiles, func))
+
+
 def get_stack_profiler_path(start, end, repo):
     date_list = [datetime.datetime.fromtimestamp(end)]
     date_now = date_list[0].date()
@@ -125,8 +157,8 @@ def get_stack_profiler_path(start, end, repo):
         date_now = date_pre
 
     print date_list
-    return ['/logdir/{}/{}{:02d}{:02d}/{}.stack'.format(date.year, date.year, date.month, date.day, repo) for
-            date in set(date_list)]
+    return ['{}/{}/{}{:02d}{:02d}/{}.stack'.format(stack_profiler_viewer.LOG_DIR, date.year, date.year, date.month,
+                                                   date.day, repo) for date in set(date_list)]
 
 
 @app.route("/stack_profiler", methods=['GET'])
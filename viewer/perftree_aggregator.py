@@ -0,0 +1,335 @@
+import argparse
+import datetime
+import gzip
+import json
+import math
+import os
+import re
+import time
+
+import stack_profiler_viewer
+
+CACHE_DIR = '/tmp/perftree_aggregate'
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+MAX_DAYS = 31
+
+# matches the node keys written by generic_profiler.log_performance_tree, e.g. '[ 42.0%,0.120s] foo.bar<a.py:12>'
+NODE_PATTERN = re.compile(r'^\[\s*([-\d.]+)%,\s*([-\d.]+)s\] (.*?)<(.*)>$')
+LOG_SUFFIX_PATTERN = re.compile(r'\.log(\.gz)?$')
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with logarithmic buckets, the answer of a quantile query is within
+    `relative_accuracy` of the exact value. Sketches with the same accuracy can be merged by adding bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('can not merge sketches with different accuracy')
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'zero_count': self.zero_count, 'count': self.count,
+                'min': self.min, 'max': self.max, 'buckets': [[k, v] for k, v in self.buckets.items()]}
+
+    @staticmethod
+    def from_dict(d):
+        sketch = QuantileSketch(d['relative_accuracy'])
+        sketch.buckets = dict((int(k), v) for k, v in d['buckets'])
+        sketch.zero_count = d['zero_count']
+        sketch.count = d['count']
+        sketch.min = d['min']
+        sketch.max = d['max']
+        return sketch
+
+
+class LatencyStats(object):
+    """
+    Call count, total time and latency sketch of a function or a call site
+    """
+
+    def __init__(self, sketch=None):
+        self.count = 0
+        self.total = 0.0
+        self.sketch = sketch if sketch else QuantileSketch()
+
+    def add(self, time_elapsed):
+        self.count += 1
+        self.total += time_elapsed
+        self.sketch.add(time_elapsed)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.sketch.merge(other.sketch)
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        output = {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0,
+                  'max': self.sketch.max}
+        for q in quantiles:
+            output['p{:g}'.format(q * 100)] = self.sketch.quantile(q)
+        return output
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'sketch': self.sketch.to_dict()}
+
+    @staticmethod
+    def from_dict(d):
+        stats = LatencyStats(QuantileSketch.from_dict(d['sketch']))
+        stats.count = d['count']
+        stats.total = d['total']
+        return stats
+
+
+class Aggregation(object):
+    """
+    Latency statistics per function and per call site, where a call site is a (function, caller location) pair.
+    A recursive call is only counted once per function, by its outermost node, but once per call site.
+    """
+
+    SITE_SEPARATOR = '@'
+
+    def __init__(self):
+        self.functions = {}
+        self.call_sites = {}
+        self.records = 0
+
+    def add(self, func, location, time_elapsed, nested=False):
+        if not nested:
+            self.functions.setdefault(func, LatencyStats()).add(time_elapsed)
+        site = '{}{}{}'.format(func, Aggregation.SITE_SEPARATOR, location)
+        self.call_sites.setdefault(site, LatencyStats()).add(time_elapsed)
+
+    def add_tree(self, tree, callers=frozenset()):
+        for key, children in tree.items():
+            match = NODE_PATTERN.match(key)
+            child_callers = callers
+            if match:
+                _, time_elapsed, func, location = match.groups()
+                # the time of a recursive call is already included in its outermost caller of the same function
+                self.add(func, location, float(time_elapsed), nested=func in callers)
+                child_callers = callers | frozenset([func])
+            for child in children:
+                # intervals between calls are logged as plain strings, only dicts are real calls
+                if isinstance(child, dict):
+                    self.add_tree(child, child_callers)
+
+    def merge(self, other):
+        for name, stats in other.functions.items():
+            self.functions.setdefault(name, LatencyStats()).merge(stats)
+        for name, stats in other.call_sites.items():
+            self.call_sites.setdefault(name, LatencyStats()).merge(stats)
+        self.records += other.records
+
+    def summary(self, quantiles=DEFAULT_QUANTILES, func=None):
+        def select(stats_map):
+            return dict((name, stats.summary(quantiles)) for name, stats in stats_map.items()
+                        if func is None or name == func or name.startswith(func + Aggregation.SITE_SEPARATOR))
+
+        return {'records': self.records, 'functions': select(self.functions), 'call_sites': select(self.call_sites)}
+
+    def to_dict(self):
+        return {'records': self.records,
+                'functions': dict((k, v.to_dict()) for k, v in self.functions.items()),
+                'call_sites': dict((k, v.to_dict()) for k, v in self.call_sites.items())}
+
+    @staticmethod
+    def from_dict(d):
+        aggregation = Aggregation()
+        aggregation.records = d['records']
+        aggregation.functions = dict((k, LatencyStats.from_dict(v)) for k, v in d['functions'].items())
+        aggregation.call_sites = dict((k, LatencyStats.from_dict(v)) for k, v in d['call_sites'].items())
+        return aggregation
+
+
+def handle_file(f, aggregation):
+    for line in f:
+        index = line.find(': ')
+        if index < 0:
+            continue
+        try:
+            content_json = json.loads(line[index + 2:])
+        except ValueError:
+            continue
+        if not isinstance(content_json, dict):
+            continue
+        content_json.pop('parameter', None)
+        aggregation.add_tree(content_json)
+        aggregation.records += 1
+
+
+def get_log_dir(date, repo):
+    return '{}/{}/{}{:02d}{:02d}/{}.perftree'.format(stack_profiler_viewer.LOG_DIR, date.year, date.year, date.month,
+                                                     date.day, repo)
+
+
+def get_log_path(date, repo, host):
+    path = '{}/{}.log'.format(get_log_dir(date, repo), host)
+    if os.path.isfile(path):
+        return path
+    path += '.gz'
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def get_hosts(date, repo):
+    log_dir = get_log_dir(date, repo)
+    if not os.path.isdir(log_dir):
+        return []
+    # host names may contain dots (FQDN), so only the log suffix is stripped
+    return sorted(set(LOG_SUFFIX_PATTERN.sub('', file_name) for file_name in os.listdir(log_dir)
+                      if LOG_SUFFIX_PATTERN.search(file_name)))
+
+
+def get_cache_path(date, repo, host):
+    return '{}/{}/{}{:02d}{:02d}/{}.json'.format(CACHE_DIR, repo, date.year, date.month, date.day, host)
+
+
+def aggregate_file(path):
+    aggregation = Aggregation()
+    if path.endswith('.gz'):
+        with gzip.open(path) as f:
+            handle_file(f, aggregation)
+    else:
+        with open(path) as f:
+            handle_file(f, aggregation)
+    return aggregation
+
+
+def aggregate_day(date, repo, host):
+    """
+    Aggregate the perftree log of one host in one day. The result is cached together with the mtime and size of
+    the log, so it is only re-parsed when the log has been appended or rotated.
+    """
+    path = get_log_path(date, repo, host)
+    if not path:
+        return Aggregation()
+    stat = os.stat(path)
+    source = {'path': path, 'mtime': stat.st_mtime, 'size': stat.st_size}
+    cache_path = get_cache_path(date, repo, host)
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached['source'] == source:
+                return Aggregation.from_dict(cached['aggregation'])
+        except (ValueError, KeyError):
+            pass
+    aggregation = aggregate_file(path)
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'source': source, 'aggregation': aggregation.to_dict()}, f)
+    os.rename(tmp_path, cache_path)
+    return aggregation
+
+
+def get_dates(start_date, end_date):
+    if end_date < start_date:
+        raise ValueError('end date {} is before start date {}'.format(end_date, start_date))
+    days = (end_date - start_date).days + 1
+    if days > MAX_DAYS:
+        raise ValueError('can not aggregate more than {} days, got {}'.format(MAX_DAYS, days))
+    return [start_date + datetime.timedelta(days=i) for i in range(days)]
+
+
+def check_name(name):
+    # repo and host names are used in the log and cache paths, they must not escape the log or cache directory
+    if not name or '/' in name or '..' in name:
+        raise ValueError('invalid name: {}'.format(name))
+
+
+def aggregate(start_date, end_date, repo, hosts=None):
+    """
+    Merge the daily aggregations of every host from `start_date` to `end_date`, both inclusive, returns a dict of
+    host -> Aggregation. Every record of these days is counted, so the results always cover whole days.
+    """
+    check_name(repo)
+    for host in (hosts if hosts else []):
+        check_name(host)
+    result = {}
+    for date in get_dates(start_date, end_date):
+        for host in (hosts if hosts else get_hosts(date, repo)):
+            result.setdefault(host, Aggregation()).merge(aggregate_day(date, repo, host))
+    return result
+
+
+def valid_day(val):
+    return datetime.datetime.fromtimestamp(stack_profiler_viewer.valid_date(val)).date()
+
+
+def merge_hosts(aggregations):
+    merged = Aggregation()
+    for aggregation in aggregations.values():
+        merged.merge(aggregation)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aggregate latency statistics of generic profiler perftree logs',
+                                     prog='python perftree_aggregator',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--repo", "-r", help="repo name of the logs", default="default")
+    parser.add_argument("--hosts", help="hosts joined by '+', all hosts if not set", default=None)
+    parser.add_argument("--start-date", '-S', help="first day, timestamp or date str that can be parsed by "
+                                                   "dateutil.parser", default=str(int(time.time())), type=valid_day)
+    parser.add_argument("--end-date", '-E', help="last day, defaults to the first day", default=None, type=valid_day)
+    parser.add_argument("--func", help="only output the statistics of this function", default=None)
+    parser.add_argument("--by-host", action='store_true', help="output the statistics of each host separately")
+    args = parser.parse_args()
+
+    aggregations = aggregate(args.start_date, args.end_date if args.end_date else args.start_date, args.repo,
+                             args.hosts.split('+') if args.hosts else None)
+    if args.by_host:
+        output = dict((host, aggregation.summary(func=args.func)) for host, aggregation in aggregations.items())
+    else:
+        output = merge_hosts(aggregations).summary(func=args.func)
+    print(json.dumps(output, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ import dateutil.parser
 # import bryo.utils.s3util
 
 SOURCE_FILE_FILTER = re.compile('^/nail/srv/')
+LOG_DIR = '/logdir'
 
 
 class CollectorFormatter(object):